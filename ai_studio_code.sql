@@ -3,8 +3,11 @@
 CREATE TABLE USERS (
     id BIGSERIAL PRIMARY KEY,
     name VARCHAR(20) UNIQUE NOT NULL, -- Added UNIQUE constraint for name, max 20 chars
-    hashed_password VARCHAR(80) NOT NULL  -- Increased length to accommodate bcrypt hashes
+    hashed_password VARCHAR(100) NOT NULL  -- Increased length to accommodate bcrypt_sha256 hashes
 );
+-- Existing databases: run this ALTER once by hand; the old VARCHAR(80) column rejects
+-- bcrypt_sha256 hashes (83 chars). It is a no-op on a fresh schema.
+ALTER TABLE USERS ALTER COLUMN hashed_password TYPE VARCHAR(100);
 
 -- 2. TOOLS Table
 -- Represents available tools in the system.
@@ -78,4 +81,14 @@ CREATE TABLE SESSIONS_CHAT (
     FOREIGN KEY (chat_id) 
         REFERENCES CHATS(id) 
         ON DELETE CASCADE
-);
\ No newline at end of file
+);
+
+-- 8. Indexes
+-- USERS_TOOLS is keyed (user_id, tool_name), so lookups by tool_name (the
+-- user_ids aggregation in the tool listings) can't use the primary key.
+-- INCLUDE (user_id) lets those lookups be answered from the index alone.
+-- SESSIONS_CHAT needs nothing extra: its (session_id, chat_id) primary key
+-- already covers the per-session chat lookup.
+-- Existing databases: run this CREATE INDEX once by hand (it is safe to re-run).
+CREATE INDEX IF NOT EXISTS ix_users_tools_tool_name
+    ON USERS_TOOLS (tool_name) INCLUDE (user_id);
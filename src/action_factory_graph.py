@@ -3,74 +3,271 @@ Action Factory - LangGraph Implementation
 A problem-solving workflow that creates and uses tools dynamically
 """
 
-from typing import TypedDict, List, Dict, Any, Annotated
+from typing import TypedDict, List, Dict, Any, Annotated, AsyncIterator, Optional, Tuple
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from langchain_core.tools import BaseTool
-from langchain_core.prompts import ChatPromptTemplate
+from langgraph.types import Send
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+from langchain_core.tools import BaseTool, tool
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+import functools
+import io
 import json
 import logging
+import operator
+import re
+import sys
+import threading
+import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    orjson = None
+
+# Library module: log through a module logger and leave root configuration to the application
 logger = logging.getLogger(__name__)
 
 
-class ActionFactoryState(TypedDict):
-    """State for the Action Factory workflow"""
-    messages: Annotated[List[BaseMessage], add_messages]
-    user_prompt: str
-    problem_steps: List[Dict[str, Any]]
-    current_step_index: int
-    available_tools: Dict[str, BaseTool]
-    step_results: List[Dict[str, Any]]
-    final_answer: str
-    workflow_complete: bool
+# Shared pool for running a step's (mostly I/O-bound) tools concurrently
+_TOOL_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="action-factory-tool")
+# A tool's own run time limit, counted from when a worker starts it
+_TOOL_TIMEOUT_SECONDS = 30
+# How long a submitted tool may wait for a free worker before it is cancelled unrun
+_TOOL_QUEUE_TIMEOUT_SECONDS = 60
+
+# Outermost JSON list in a reply that wraps it in prose or markdown fences
+_JSON_LIST_BLOCK = re.compile(r"\[.*\]", re.DOTALL)
+
+# A tool that keeps failing test_tool is rebuilt at most this many times, backing off between attempts
+MAX_TOOL_RETRIES = 2
+_RETRY_BACKOFF_BASE_SECONDS = 0.2
 
+# Prompts at least this long are never answered directly from a single step result
+_DIRECT_ANSWER_MAX_PROMPT_CHARS = 120
+# A sentence terminator followed by more text means the prompt has several sentences
+_SENTENCE_BREAK = re.compile(r"[.!?]\s+\S")
 
+
+@dataclass(slots=True)
 class ProblemStep:
     """Represents a single step in the problem-solving process"""
-    def __init__(self, description: str, required_tools: List[str] = None, dependencies: List[int] = None):
-        self.description = description
-        self.required_tools = required_tools or []
-        self.dependencies = dependencies or []
-        self.completed = False
-        self.result = None
-        self.tools_created = []
+    description: str
+    required_tools: List[str] = field(default_factory=list)
+    dependencies: List[int] = field(default_factory=list)
+    completed: bool = False
+    result: Optional[str] = None
+    tools_created: List[str] = field(default_factory=list)
+
+
+def _merge_step_updates(existing: List[ProblemStep], update) -> List[ProblemStep]:
+    """Reducer for problem_steps: a list replaces the plan, a {index: {field: value}} dict updates steps in place"""
+    if isinstance(update, dict):
+        for step_index, patch in update.items():
+            step = existing[step_index]
+            for name, value in patch.items():
+                setattr(step, name, value)
+        return existing
+    return update
+
+
+@dataclass(slots=True)
+class ActionFactoryState:
+    """State for the Action Factory workflow
+    
+    Nodes read fields as attributes and return dicts holding only the keys they change.
+    """
+    messages: Annotated[List[BaseMessage], add_messages] = field(default_factory=list)
+    user_prompt: str = ""
+    problem_steps: Annotated[List[ProblemStep], _merge_step_updates] = field(default_factory=list)
+    step_levels: List[List[int]] = field(default_factory=list)
+    current_level_index: int = 0
+    available_tools: Dict[str, BaseTool] = field(default_factory=dict)
+    missing_tools_cache: Dict[int, List[str]] = field(default_factory=dict)
+    failed_tools: List[str] = field(default_factory=list)
+    tool_retry_count: Dict[str, int] = field(default_factory=dict)
+    step_results: Annotated[List[Dict[str, Any]], operator.add] = field(default_factory=list)
+    final_answer: str = ""
+    workflow_complete: bool = False
+
+
+class StepState(TypedDict):
+    """Per-step payload sent to solve_step when a level fans out"""
+    step_index: int
+    step: ProblemStep
+    available_tools: Dict[str, BaseTool]
+
+
+def _json_loads(data: str) -> Any:
+    """Parse JSON with orjson when available (orjson.JSONDecodeError subclasses json's)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _flatten_content(content: Any) -> str:
+    """Flatten message content (a str, or a list of str / {"text": ...} parts as Gemini returns) to text"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            part if isinstance(part, str) else part.get("text", "")
+            for part in content
+            if isinstance(part, (str, dict))
+        )
+    return str(content)
+
+
+def _parse_json_list(content: str) -> Any:
+    """Parse an LLM's JSON list reply, falling back to the first [...] block it contains"""
+    try:
+        return _json_loads(content)
+    except json.JSONDecodeError:
+        match = _JSON_LIST_BLOCK.search(content)
+        if match is None:
+            raise
+        return _json_loads(match.group(0))
+
+
+def _problem_steps_from_data(steps_data: Any) -> List[ProblemStep]:
+    """Build ProblemSteps from a parsed plan, raising ValueError unless it is a list of step objects"""
+    if not isinstance(steps_data, list):
+        raise ValueError(f"Plan is not a JSON list: {steps_data!r}")
+    
+    problem_steps = []
+    for step in steps_data:
+        if not isinstance(step, dict) or not isinstance(step.get("description"), str):
+            raise ValueError(f"Plan entry is not a step object: {step!r}")
+        
+        required_tools = step.get("required_tools", [])
+        dependencies = step.get("dependencies", [])
+        if not isinstance(required_tools, list) or not all(isinstance(name, str) for name in required_tools):
+            raise ValueError(f"Step required_tools is not a list of names: {required_tools!r}")
+        if not isinstance(dependencies, list):
+            raise ValueError(f"Step dependencies is not a list: {dependencies!r}")
+        
+        problem_steps.append(ProblemStep(
+            description=step["description"],
+            required_tools=required_tools,
+            dependencies=dependencies
+        ))
+    
+    return problem_steps
+
+
+def _json_dumps_indented(obj: Any) -> str:
+    """Serialize to 2-space indented JSON with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
+
+
+@functools.lru_cache(maxsize=256)
+def _build_basic_tool(tool_name: str, step_description: str) -> BaseTool:
+    """Build (once per name/description pair) the placeholder tool used by make_tool"""
+    @tool(tool_name)
+    def basic_tool(query: str) -> str:
+        """A basic tool for problem solving"""
+        return f"Tool {tool_name} processed: {query} for step: {step_description}"
+    
+    # Its output only echoes the step, so it must never be mistaken for an answer
+    basic_tool.metadata = {"placeholder": True}
+    return basic_tool
+
+
+def _is_placeholder_tool(tool: BaseTool) -> bool:
+    """Whether a tool is one of make_tool's template placeholders"""
+    return bool((tool.metadata or {}).get("placeholder"))
+
+
+def _instance(config: RunnableConfig) -> "ActionFactoryGraph":
+    """The ActionFactoryGraph instance a run of the shared compiled graph is bound to"""
+    instance = config.get("configurable", {}).get("action_factory")
+    if instance is None:
+        raise ValueError(
+            "No ActionFactoryGraph bound to this run; invoke ActionFactoryGraph(...).graph "
+            "(or run/arun/astream) rather than the shared compiled graph"
+        )
+    return instance
+
+
+def _bound(method_name: str) -> RunnableLambda:
+    """Node/edge runnable that dispatches to the ActionFactoryGraph instance in the run config
+    
+    Under ainvoke/astream the async variant a<method_name> is awaited when the instance
+    defines one; otherwise the sync method is called directly.
+    """
+    def call(state, config: RunnableConfig):
+        return getattr(_instance(config), method_name)(state)
+    
+    async def acall(state, config: RunnableConfig):
+        instance = _instance(config)
+        async_method = getattr(instance, f"a{method_name}", None)
+        if async_method is None:
+            return getattr(instance, method_name)(state)
+        return await async_method(state)
+    
+    return RunnableLambda(call, afunc=acall, name=method_name)
 
 
 class ActionFactoryGraph:
     """Main Action Factory workflow implementation using LangGraph"""
     
-    def __init__(self, llm=None):
+    # The graph topology never depends on the instance, so it is compiled once and shared
+    _COMPILED_GRAPH = None
+    
+    def __init__(self, llm=None, max_concurrency: int = 8):
         self.llm = llm
-        self.graph = self._build_graph()
+        # Upper bound on solve_step branches (and their tool/LLM calls) running at once
+        self.max_concurrency = max_concurrency
+        # The shared compiled graph with this instance bound, so self.graph.invoke(state) works directly
+        self.graph = self._get_compiled_graph().with_config(
+            configurable={"action_factory": self},
+            max_concurrency=max_concurrency
+        )
     
-    def _build_graph(self) -> StateGraph:
-        """Build the LangGraph workflow"""
+    @classmethod
+    def _get_compiled_graph(cls):
+        """Return the shared compiled graph, building it on first use"""
+        if ActionFactoryGraph._COMPILED_GRAPH is None:
+            ActionFactoryGraph._COMPILED_GRAPH = cls._build_graph()
+        return ActionFactoryGraph._COMPILED_GRAPH
+    
+    @staticmethod
+    def _build_graph() -> StateGraph:
+        """Build the LangGraph workflow
+        
+        Nodes and edges are bound by name and resolved against the instance passed
+        as configurable["action_factory"] on each run (see __init__).
+        """
         workflow = StateGraph(ActionFactoryState)
         
         # Add nodes
-        workflow.add_node("create_problem_steps", self.create_problem_steps)
-        workflow.add_node("check_tool_exists", self.check_tool_exists)
-        workflow.add_node("make_tool", self.make_tool)
-        workflow.add_node("test_tool", self.test_tool)
-        workflow.add_node("solve_step", self.solve_step)
-        workflow.add_node("finalize_answer", self.finalize_answer)
-        workflow.add_node("give_user_answer", self.give_user_answer)
+        workflow.add_node("create_problem_steps", _bound("create_problem_steps"))
+        workflow.add_node("check_tool_exists", _bound("check_tool_exists"))
+        workflow.add_node("make_tool", _bound("make_tool"))
+        workflow.add_node("test_tool", _bound("test_tool"))
+        workflow.add_node("solve_step", _bound("solve_step"))
+        workflow.add_node("finalize_answer", _bound("finalize_answer"))
+        workflow.add_node("give_user_answer", _bound("give_user_answer"))
+        workflow.add_node("advance_level", _bound("advance_level"))
         
         # Add edges
         workflow.add_edge(START, "create_problem_steps")
         workflow.add_edge("create_problem_steps", "check_tool_exists")
         
         # Conditional edges
+        # Routing into solve_step fans out one Send per step in the current level
         workflow.add_conditional_edges(
             "check_tool_exists",
-            self.tool_exists_condition,
+            _bound("tool_exists_condition"),
             {
                 "make_tool": "make_tool",
-                "solve_step": "solve_step"
+                "solve_step": "solve_step",
+                "finalize_answer": "finalize_answer"
             }
         )
         
@@ -78,16 +275,19 @@ class ActionFactoryGraph:
         
         workflow.add_conditional_edges(
             "test_tool",
-            self.tool_works_condition,
+            _bound("tool_works_condition"),
             {
                 "solve_step": "solve_step",
                 "make_tool": "make_tool"  # Retry if tool doesn't work
             }
         )
         
+        # Parallel solve_step branches fan in here before the next level starts
+        workflow.add_edge("solve_step", "advance_level")
+        
         workflow.add_conditional_edges(
-            "solve_step",
-            self.next_step_condition,
+            "advance_level",
+            _bound("next_step_condition"),
             {
                 "check_tool_exists": "check_tool_exists",
                 "finalize_answer": "finalize_answer"
@@ -99,268 +299,377 @@ class ActionFactoryGraph:
         
         return workflow.compile()
     
-    def create_problem_steps(self, state: ActionFactoryState) -> ActionFactoryState:
+    def create_problem_steps(self, state: ActionFactoryState) -> Dict[str, Any]:
         """Break down the user prompt into problem-solving steps"""
         logger.info("Creating problem steps...")
         
-        prompt = f"""
-        User wants to solve: {state['user_prompt']}
-        
-        Break this down into clear, actionable steps. For each step, identify:
-        1. What needs to be done
-        2. What tools might be needed
-        3. Dependencies on other steps
+        response = None
+        if self.llm:
+            response = self.llm.invoke([HumanMessage(content=self._problem_steps_prompt(state))])
         
-        Return a JSON list of steps with format:
-        [
-            {{
-                "description": "step description",
-                "required_tools": ["tool1", "tool2"],
-                "dependencies": [0, 1]  // indices of prerequisite steps
-            }}
-        ]
-        """
+        return self._problem_steps_update(state, response)
+    
+    async def acreate_problem_steps(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Async variant of create_problem_steps used by arun/astream"""
+        logger.info("Creating problem steps...")
         
+        response = None
         if self.llm:
-            response = self.llm.invoke([HumanMessage(content=prompt)])
-            try:
-                steps_data = json.loads(response.content)
-                problem_steps = [
-                    {
-                        "description": step["description"],
-                        "required_tools": step.get("required_tools", []),
-                        "dependencies": step.get("dependencies", []),
-                        "completed": False,
-                        "result": None
-                    }
-                    for step in steps_data
-                ]
-            except json.JSONDecodeError:
-                # Fallback: create basic steps
-                problem_steps = [
-                    {
-                        "description": f"Analyze and solve: {state['user_prompt']}",
-                        "required_tools": ["analysis_tool"],
-                        "dependencies": [],
-                        "completed": False,
-                        "result": None
-                    }
-                ]
-        else:
-            # Fallback when no LLM is provided
-            problem_steps = [
-                {
-                    "description": f"Solve the problem: {state['user_prompt']}",
-                    "required_tools": ["basic_solver"],
-                    "dependencies": [],
-                    "completed": False,
-                    "result": None
-                }
-            ]
+            response = await self.llm.ainvoke([HumanMessage(content=self._problem_steps_prompt(state))])
         
-        return {
-            **state,
-            "problem_steps": problem_steps,
-            "current_step_index": 0,
-            "step_results": []
-        }
+        return self._problem_steps_update(state, response)
     
-    def check_tool_exists(self, state: ActionFactoryState) -> ActionFactoryState:
-        """Check if required tools exist for the current step"""
-        logger.info(f"Checking tools for step {state['current_step_index']}...")
-        
-        if state["current_step_index"] >= len(state["problem_steps"]):
-            return state
+    def check_tool_exists(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Check if required tools exist for the current level of steps"""
+        logger.info("Checking tools for level %d...", state.current_level_index)
         
-        current_step = state["problem_steps"][state["current_step_index"]]
-        required_tools = current_step["required_tools"]
-        available_tools = state.get("available_tools", {})
+        if state.current_level_index >= len(state.step_levels):
+            return {}
         
-        missing_tools = [tool for tool in required_tools if tool not in available_tools]
+        missing_tools = self._missing_tools(state)
         
         # Add information about tool availability to messages
         if missing_tools:
-            message = f"Missing tools for step {state['current_step_index']}: {missing_tools}"
+            message = f"Missing tools for level {state.current_level_index}: {missing_tools}"
         else:
-            message = f"All required tools available for step {state['current_step_index']}"
+            message = f"All required tools available for level {state.current_level_index}"
         
+        # Memoize for tool_exists_condition and make_tool
         return {
-            **state,
-            "messages": state["messages"] + [AIMessage(content=message)]
+            "missing_tools_cache": {
+                **state.missing_tools_cache,
+                state.current_level_index: missing_tools
+            },
+            "messages": [AIMessage(content=message)]
         }
     
-    def make_tool(self, state: ActionFactoryState) -> ActionFactoryState:
-        """Create the required tools for the current step"""
+    def make_tool(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Create the required tools for the current level of steps"""
         logger.info("Creating tools...")
         
-        if state["current_step_index"] >= len(state["problem_steps"]):
-            return state
+        if state.current_level_index >= len(state.step_levels):
+            return {}
         
-        current_step = state["problem_steps"][state["current_step_index"]]
-        required_tools = current_step["required_tools"]
-        available_tools = state.get("available_tools", {})
+        delay = self._retry_backoff_seconds(state)
+        if delay:
+            time.sleep(delay)
         
-        # Create missing tools (simplified implementation)
-        for tool_name in required_tools:
-            if tool_name not in available_tools:
-                # Create a basic tool implementation
-                tool = self._create_basic_tool(tool_name, current_step["description"])
-                available_tools[tool_name] = tool
+        return self._make_tools_update(state)
+    
+    async def amake_tool(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Async variant of make_tool that backs off without blocking the event loop"""
+        logger.info("Creating tools...")
         
-        message = f"Created tools: {[tool for tool in required_tools if tool not in state.get('available_tools', {})]}"
+        if state.current_level_index >= len(state.step_levels):
+            return {}
         
-        return {
-            **state,
-            "available_tools": available_tools,
-            "messages": state["messages"] + [AIMessage(content=message)]
-        }
+        delay = self._retry_backoff_seconds(state)
+        if delay:
+            await asyncio.sleep(delay)
+        
+        return self._make_tools_update(state)
     
-    def test_tool(self, state: ActionFactoryState) -> ActionFactoryState:
+    def test_tool(self, state: ActionFactoryState) -> Dict[str, Any]:
         """Test if the created tools work correctly"""
         logger.info("Testing tools...")
         
-        if state["current_step_index"] >= len(state["problem_steps"]):
-            return state
+        if state.current_level_index >= len(state.step_levels):
+            return {}
         
-        current_step = state["problem_steps"][state["current_step_index"]]
-        required_tools = current_step["required_tools"]
-        available_tools = state.get("available_tools", {})
+        required_tools = self._level_required_tools(state)
+        available_tools = state.available_tools
         
         # Test each required tool
         tool_test_results = {}
-        for tool_name in required_tools:
+        for tool_name, step_description in required_tools.items():
             if tool_name in available_tools:
                 tool = available_tools[tool_name]
                 try:
                     # Basic test - just check if tool can be called
-                    test_result = self._test_tool(tool, current_step["description"])
+                    test_result = self._test_tool(tool, step_description)
                     tool_test_results[tool_name] = test_result
                 except Exception as e:
                     tool_test_results[tool_name] = False
-                    logger.error(f"Tool {tool_name} failed test: {e}")
-        
-        all_tools_work = all(tool_test_results.values())
-        message = f"Tool test results: {tool_test_results}. All working: {all_tools_work}"
+                    logger.error("Tool %s failed test: %s", tool_name, e)
         
-        return {
-            **state,
-            "messages": state["messages"] + [AIMessage(content=message)]
-        }
+        return self._tool_test_update(tool_test_results)
     
-    def solve_step(self, state: ActionFactoryState) -> ActionFactoryState:
-        """Solve the current step using available tools"""
-        logger.info(f"Solving step {state['current_step_index']}...")
+    async def atest_tool(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Async variant of test_tool that awaits the level's tool tests concurrently"""
+        logger.info("Testing tools...")
+        
+        if state.current_level_index >= len(state.step_levels):
+            return {}
         
-        if state["current_step_index"] >= len(state["problem_steps"]):
-            return state
+        required_tools = self._level_required_tools(state)
+        available_tools = state.available_tools
         
-        current_step = state["problem_steps"][state["current_step_index"]]
-        available_tools = state.get("available_tools", {})
+        tool_names = [tool_name for tool_name in required_tools if tool_name in available_tools]
+        outcomes = await asyncio.gather(
+            *(self._atest_tool(available_tools[tool_name], required_tools[tool_name]) for tool_name in tool_names),
+            return_exceptions=True
+        )
+        
+        tool_test_results = {}
+        for tool_name, outcome in zip(tool_names, outcomes):
+            if isinstance(outcome, Exception):
+                tool_test_results[tool_name] = False
+                logger.error("Tool %s failed test: %s", tool_name, outcome)
+            else:
+                tool_test_results[tool_name] = outcome
+        
+        return self._tool_test_update(tool_test_results)
+    
+    def solve_step(self, step_state: StepState) -> Dict[str, Any]:
+        """Solve a single step using available tools (runs once per step in a level)"""
+        step_index = step_state["step_index"]
+        current_step = step_state["step"]
+        logger.info("Solving step %d...", step_index)
         
         # Use tools to solve the step
-        step_result = self._solve_with_tools(current_step, available_tools)
+        step_result, tool_outputs = self._solve_with_tools(current_step, step_state["available_tools"])
         
-        # Mark step as completed
-        updated_steps = state["problem_steps"].copy()
-        updated_steps[state["current_step_index"]]["completed"] = True
-        updated_steps[state["current_step_index"]]["result"] = step_result
+        return self._step_solved_update(step_index, current_step, step_result, tool_outputs, step_state["available_tools"])
+    
+    async def asolve_step(self, step_state: StepState) -> Dict[str, Any]:
+        """Async variant of solve_step used by arun/astream"""
+        step_index = step_state["step_index"]
+        current_step = step_state["step"]
+        logger.info("Solving step %d...", step_index)
         
-        step_results = state.get("step_results", [])
-        step_results.append({
-            "step_index": state["current_step_index"],
-            "description": current_step["description"],
-            "result": step_result
-        })
+        step_result, tool_outputs = await self._asolve_with_tools(current_step, step_state["available_tools"])
         
-        message = f"Completed step {state['current_step_index']}: {current_step['description']}"
+        return self._step_solved_update(step_index, current_step, step_result, tool_outputs, step_state["available_tools"])
+    
+    def advance_level(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Move to the next level once every step of the current one is solved"""
+        logger.info("Completed level %d...", state.current_level_index)
         
         return {
-            **state,
-            "problem_steps": updated_steps,
-            "step_results": step_results,
-            "current_step_index": state["current_step_index"] + 1,
-            "messages": state["messages"] + [AIMessage(content=message)]
+            "current_level_index": state.current_level_index + 1,
+            "failed_tools": []
         }
     
-    def finalize_answer(self, state: ActionFactoryState) -> ActionFactoryState:
+    def finalize_answer(self, state: ActionFactoryState) -> Dict[str, Any]:
         """Finalize the answer using user prompts and step results"""
         logger.info("Finalizing answer...")
         
-        step_results = state.get("step_results", [])
-        user_prompt = state["user_prompt"]
+        if self.llm and not self._needs_synthesis(state):
+            return self._direct_answer_update(state)
         
         # Combine all step results into a final answer
+        response = None
         if self.llm:
-            prompt = f"""
-            Original user request: {user_prompt}
-            
-            Step results:
-            {json.dumps(step_results, indent=2)}
-            
-            Please provide a comprehensive final answer that addresses the user's original request,
-            incorporating all the step results.
-            """
-            
-            response = self.llm.invoke([HumanMessage(content=prompt)])
-            final_answer = response.content
-        else:
-            # Fallback answer
-            final_answer = f"Solved '{user_prompt}' through {len(step_results)} steps. Results: {[r['result'] for r in step_results]}"
+            response = self.llm.invoke([HumanMessage(content=self._final_answer_prompt(state))])
         
-        return {
-            **state,
-            "final_answer": final_answer,
-            "workflow_complete": True
-        }
+        return self._final_answer_update(state, response)
+    
+    async def afinalize_answer(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Async variant of finalize_answer used by arun/astream"""
+        logger.info("Finalizing answer...")
+        
+        if self.llm and not self._needs_synthesis(state):
+            return self._direct_answer_update(state)
+        
+        response = None
+        if self.llm:
+            response = await self.llm.ainvoke([HumanMessage(content=self._final_answer_prompt(state))])
+        
+        return self._final_answer_update(state, response)
     
-    def give_user_answer(self, state: ActionFactoryState) -> ActionFactoryState:
+    def give_user_answer(self, state: ActionFactoryState) -> Dict[str, Any]:
         """Present the final answer to the user"""
         logger.info("Presenting final answer to user...")
         
-        final_answer = state.get("final_answer", "No solution generated")
+        final_answer = state.final_answer
         
         return {
-            **state,
-            "messages": state["messages"] + [AIMessage(content=final_answer)]
+            "messages": [AIMessage(content=final_answer)]
         }
     
     # Condition functions for conditional edges
     
-    def tool_exists_condition(self, state: ActionFactoryState) -> str:
-        """Determine if tools exist for current step"""
-        if state["current_step_index"] >= len(state["problem_steps"]):
-            return "solve_step"
-        
-        current_step = state["problem_steps"][state["current_step_index"]]
-        required_tools = current_step["required_tools"]
-        available_tools = state.get("available_tools", {})
+    def tool_exists_condition(self, state: ActionFactoryState):
+        """Determine if tools exist for the current level"""
+        if state.current_level_index >= len(state.step_levels):
+            return "finalize_answer"
         
-        missing_tools = [tool for tool in required_tools if tool not in available_tools]
-        
-        return "make_tool" if missing_tools else "solve_step"
+        return "make_tool" if self._missing_tools(state) else self.dispatch_level(state)
     
-    def tool_works_condition(self, state: ActionFactoryState) -> str:
-        """Determine if tools work correctly"""
-        # For simplicity, assume tools work after creation
-        # In a real implementation, you'd check the test results
-        return "solve_step"
+    def tool_works_condition(self, state: ActionFactoryState):
+        """Rebuild failing tools while they have retries left, otherwise solve the level"""
+        return "make_tool" if self._retryable_tools(state) else self.dispatch_level(state)
     
     def next_step_condition(self, state: ActionFactoryState) -> str:
-        """Determine if there are more steps to process"""
-        return "check_tool_exists" if state["current_step_index"] < len(state["problem_steps"]) else "finalize_answer"
+        """Determine if there are more levels to process"""
+        return "check_tool_exists" if state.current_level_index < len(state.step_levels) else "finalize_answer"
+    
+    def dispatch_level(self, state: ActionFactoryState) -> List[Send]:
+        """Fan out every step of the current level to its own solve_step branch"""
+        available_tools = state.available_tools
+        
+        return [
+            Send("solve_step", {
+                "step_index": step_index,
+                "step": state.problem_steps[step_index],
+                "available_tools": available_tools
+            })
+            for step_index in state.step_levels[state.current_level_index]
+        ]
     
     # Helper methods
     
-    def _create_basic_tool(self, tool_name: str, step_description: str) -> BaseTool:
-        """Create a basic tool implementation"""
-        from langchain_core.tools import tool
+    def _problem_steps_prompt(self, state: ActionFactoryState) -> str:
+        """Build the planning prompt for create_problem_steps"""
+        return f"""
+        User wants to solve: {state.user_prompt}
+        
+        Break this down into clear, actionable steps. For each step, identify:
+        1. What needs to be done
+        2. What tools might be needed
+        3. Dependencies on other steps
+        
+        Return a JSON list of steps with format:
+        [
+            {{
+                "description": "step description",
+                "required_tools": ["tool1", "tool2"],
+                "dependencies": [0, 1]  // indices of prerequisite steps
+            }}
+        ]
+        """
+    
+    def _problem_steps_update(self, state: ActionFactoryState, response: Optional[BaseMessage]) -> Dict[str, Any]:
+        """Turn the planner's response (None when there is no LLM) into the step-plan update"""
+        if response is not None:
+            try:
+                steps_data = _parse_json_list(_flatten_content(response.content))
+                problem_steps = _problem_steps_from_data(steps_data)
+            except ValueError:
+                # Unparseable reply, or JSON that isn't a step list (json/orjson decode errors
+                # are ValueErrors too). Fallback: create basic steps
+                problem_steps = [
+                    ProblemStep(
+                        description=f"Analyze and solve: {state.user_prompt}",
+                        required_tools=["analysis_tool"]
+                    )
+                ]
+        else:
+            # Fallback when no LLM is provided
+            problem_steps = [
+                ProblemStep(
+                    description=f"Solve the problem: {state.user_prompt}",
+                    required_tools=["basic_solver"]
+                )
+            ]
+        
+        return {
+            "problem_steps": problem_steps,
+            "step_levels": self._compute_step_levels(problem_steps),
+            "current_level_index": 0
+        }
+    
+    def _compute_step_levels(self, problem_steps: List[ProblemStep]) -> List[List[int]]:
+        """Group step indices into levels whose dependencies are all in earlier levels"""
+        pending = {
+            index: {
+                dep for dep in step.dependencies
+                if isinstance(dep, int) and 0 <= dep < len(problem_steps) and dep != index
+            }
+            for index, step in enumerate(problem_steps)
+        }
+        
+        levels = []
+        done = set()
+        while pending:
+            level = sorted(index for index, deps in pending.items() if deps <= done)
+            if not level:
+                # Circular dependencies: run whatever is left as one final level
+                level = sorted(pending)
+            levels.append(level)
+            done.update(level)
+            for index in level:
+                del pending[index]
+        
+        return levels
+    
+    def _level_required_tools(self, state: ActionFactoryState) -> Dict[str, str]:
+        """Map each tool needed by the current level to the first step description requiring it"""
+        required_tools = {}
+        for step_index in state.step_levels[state.current_level_index]:
+            step = state.problem_steps[step_index]
+            for tool_name in step.required_tools:
+                required_tools.setdefault(tool_name, step.description)
+        
+        return required_tools
+    
+    def _retryable_tools(self, state: ActionFactoryState) -> List[str]:
+        """Tools that failed test_tool for the current level and have not used up MAX_TOOL_RETRIES"""
+        return [
+            tool_name for tool_name in state.failed_tools
+            if state.tool_retry_count.get(tool_name, 0) < MAX_TOOL_RETRIES
+        ]
+    
+    def _retry_tools(self, state: ActionFactoryState) -> List[str]:
+        """Retryable tools make_tool will actually rebuild for the current level"""
+        required_tools = self._level_required_tools(state)
+        return [tool_name for tool_name in self._retryable_tools(state) if tool_name in required_tools]
+    
+    def _retry_backoff_seconds(self, state: ActionFactoryState) -> float:
+        """Exponential backoff before rebuilding failed tools (0 when nothing is being retried)"""
+        retry_counts = [state.tool_retry_count.get(tool_name, 0) for tool_name in self._retry_tools(state)]
+        if not retry_counts:
+            return 0.0
+        return _RETRY_BACKOFF_BASE_SECONDS * 2 ** max(retry_counts)
+    
+    def _make_tools_update(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Build the current level's missing tools plus any failed tools being retried"""
+        required_tools = self._level_required_tools(state)
+        available_tools = state.available_tools
+        retry_tools = self._retry_tools(state)
+        created_tools = self._missing_tools(state) + retry_tools
+        
+        # Create missing tools (simplified implementation)
+        for tool_name in created_tools:
+            # Create a basic tool implementation; a failed tool is rebuilt rather than reused
+            tool = self._create_basic_tool(
+                tool_name,
+                required_tools[tool_name],
+                force_rebuild=tool_name in retry_tools
+            )
+            available_tools[tool_name] = tool
         
-        @tool(name=tool_name)
-        def basic_tool(query: str) -> str:
-            """A basic tool for problem solving"""
-            return f"Tool {tool_name} processed: {query} for step: {step_description}"
+        message = f"Created tools: {created_tools}"
         
-        return basic_tool
+        # The level's memoized missing list is stale once its tools exist
+        missing_tools_cache = dict(state.missing_tools_cache)
+        missing_tools_cache.pop(state.current_level_index, None)
+        
+        tool_retry_count = dict(state.tool_retry_count)
+        for tool_name in retry_tools:
+            tool_retry_count[tool_name] = tool_retry_count.get(tool_name, 0) + 1
+        
+        return {
+            "available_tools": available_tools,
+            "missing_tools_cache": missing_tools_cache,
+            "tool_retry_count": tool_retry_count,
+            "messages": [AIMessage(content=message)]
+        }
+    
+    def _missing_tools(self, state: ActionFactoryState) -> List[str]:
+        """Tools the current level needs but doesn't have, memoized per level by check_tool_exists"""
+        cached = state.missing_tools_cache.get(state.current_level_index)
+        if cached is not None:
+            return cached
+        
+        required_tools = self._level_required_tools(state)
+        return sorted(required_tools.keys() - state.available_tools.keys())
+    
+    def _create_basic_tool(self, tool_name: str, step_description: str, force_rebuild: bool = False) -> BaseTool:
+        """Create a basic tool implementation (force_rebuild skips the memoized instance)"""
+        if force_rebuild:
+            return _build_basic_tool.__wrapped__(tool_name, step_description)
+        return _build_basic_tool(tool_name, step_description)
     
     def _test_tool(self, tool: BaseTool, test_input: str) -> bool:
         """Test if a tool works correctly"""
@@ -370,52 +679,230 @@ class ActionFactoryGraph:
         except Exception:
             return False
     
-    def _solve_with_tools(self, step: Dict[str, Any], tools: Dict[str, BaseTool]) -> str:
-        """Solve a step using available tools"""
-        step_description = step["description"]
-        required_tools = step["required_tools"]
+    async def _atest_tool(self, tool: BaseTool, test_input: str) -> bool:
+        """Async variant of _test_tool"""
+        try:
+            result = await tool.ainvoke(test_input)
+            return bool(result)
+        except Exception:
+            return False
+    
+    def _tool_test_update(self, tool_test_results: Dict[str, bool]) -> Dict[str, Any]:
+        """State delta recording which of the level's tools failed their test"""
+        all_tools_work = all(tool_test_results.values())
+        message = f"Tool test results: {tool_test_results}. All working: {all_tools_work}"
+        
+        return {
+            "failed_tools": [tool_name for tool_name, works in tool_test_results.items() if not works],
+            "messages": [AIMessage(content=message)]
+        }
+    
+    def _solve_with_tools(self, step: ProblemStep, tools: Dict[str, BaseTool]) -> Tuple[str, Dict[str, Any]]:
+        """Solve a step using available tools, returning the result summary and each successful tool's output"""
+        step_description = step.description
+        required_tools = step.required_tools
         
         if not required_tools:
-            return f"Completed: {step_description}"
+            return f"Completed: {step_description}", {}
+        
+        # Workers record when each tool actually starts, so time spent queued behind
+        # other steps' tools isn't charged against the tool's own timeout
+        started = {tool_name: threading.Event() for tool_name in required_tools if tool_name in tools}
+        start_times = {}
+        
+        def run_tool(tool_name: str) -> Any:
+            start_times[tool_name] = time.monotonic()
+            started[tool_name].set()
+            return tools[tool_name].invoke(step_description)
+        
+        # Use tools to solve the step, running them concurrently
+        queue_deadline = time.monotonic() + _TOOL_QUEUE_TIMEOUT_SECONDS
+        futures = {
+            tool_name: _TOOL_EXECUTOR.submit(run_tool, tool_name)
+            for tool_name in started
+        }
         
-        # Use tools to solve the step
         results = []
-        for tool_name in required_tools:
-            if tool_name in tools:
-                tool = tools[tool_name]
-                try:
-                    result = tool.invoke(step_description)
-                    results.append(f"{tool_name}: {result}")
-                except Exception as e:
-                    results.append(f"{tool_name}: Error - {str(e)}")
+        tool_outputs = {}
+        for tool_name, future in futures.items():
+            try:
+                result = self._await_tool(future, started[tool_name], lambda: start_times[tool_name], queue_deadline)
+                tool_outputs[tool_name] = result
+                results.append(f"{tool_name}: {result}")
+            except FutureTimeoutError:
+                if future.cancelled():
+                    results.append(f"{tool_name}: Error - no free worker within {_TOOL_QUEUE_TIMEOUT_SECONDS}s")
+                else:
+                    results.append(f"{tool_name}: Error - timed out after {_TOOL_TIMEOUT_SECONDS}s")
+            except Exception as e:
+                results.append(f"{tool_name}: Error - {str(e)}")
+        
+        return f"Step solved using tools. Results: {'; '.join(results)}", tool_outputs
+    
+    def _await_tool(self, future, started: threading.Event, start_time, queue_deadline: float) -> Any:
+        """Wait for a submitted tool's result
         
-        return f"Step solved using tools. Results: {'; '.join(results)}"
+        The tool's timeout runs from start_time(), once `started` is set; one still queued at
+        queue_deadline is cancelled. Raises FutureTimeoutError in both cases (future.cancelled()
+        tells them apart).
+        """
+        while not started.wait(timeout=max(0.0, queue_deadline - time.monotonic())):
+            if future.cancel():
+                raise FutureTimeoutError()
+            # A worker picked it up just now
+        return future.result(timeout=max(0.0, start_time() + _TOOL_TIMEOUT_SECONDS - time.monotonic()))
     
-    def run(self, user_prompt: str) -> Dict[str, Any]:
-        """Run the Action Factory workflow"""
-        initial_state = ActionFactoryState(
-            messages=[HumanMessage(content=user_prompt)],
-            user_prompt=user_prompt,
-            problem_steps=[],
-            current_step_index=0,
-            available_tools={},
-            step_results=[],
-            final_answer="",
-            workflow_complete=False
+    async def _asolve_with_tools(self, step: ProblemStep, tools: Dict[str, BaseTool]) -> Tuple[str, Dict[str, Any]]:
+        """Async variant of _solve_with_tools"""
+        step_description = step.description
+        required_tools = step.required_tools
+        
+        if not required_tools:
+            return f"Completed: {step_description}", {}
+        
+        tool_names = [tool_name for tool_name in required_tools if tool_name in tools]
+        outcomes = await asyncio.gather(
+            *(
+                asyncio.wait_for(tools[tool_name].ainvoke(step_description), _TOOL_TIMEOUT_SECONDS)
+                for tool_name in tool_names
+            ),
+            return_exceptions=True
         )
         
-        final_state = self.graph.invoke(initial_state)
+        results = []
+        tool_outputs = {}
+        for tool_name, outcome in zip(tool_names, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                results.append(f"{tool_name}: Error - timed out after {_TOOL_TIMEOUT_SECONDS}s")
+            elif isinstance(outcome, Exception):
+                results.append(f"{tool_name}: Error - {str(outcome)}")
+            else:
+                tool_outputs[tool_name] = outcome
+                results.append(f"{tool_name}: {outcome}")
+        
+        return f"Step solved using tools. Results: {'; '.join(results)}", tool_outputs
+    
+    def _step_solved_update(
+        self,
+        step_index: int,
+        step: ProblemStep,
+        step_result: str,
+        tool_outputs: Dict[str, Any],
+        tools: Dict[str, BaseTool]
+    ) -> Dict[str, Any]:
+        """State delta emitted by a solve_step branch"""
+        message = f"Completed step {step_index}: {step.description}"
+        
+        # Every key here has a reducer, so parallel branches merge instead of clobbering
+        return {
+            "problem_steps": {step_index: {"completed": True, "result": step_result}},
+            "step_results": [{
+                "step_index": step_index,
+                "description": step.description,
+                "result": step_result,
+                "tool_output": self._answer_tool_output(step, tool_outputs, tools)
+            }],
+            "messages": [AIMessage(content=message)]
+        }
+    
+    def _answer_tool_output(self, step: ProblemStep, tool_outputs: Dict[str, Any], tools: Dict[str, BaseTool]) -> Optional[str]:
+        """The step's raw answer when it used exactly one real (non-placeholder) tool that succeeded"""
+        if len(step.required_tools) != 1:
+            return None
+        
+        tool_name = step.required_tools[0]
+        output = tool_outputs.get(tool_name)
+        if not isinstance(output, str) or _is_placeholder_tool(tools[tool_name]):
+            return None
+        return output
+    
+    def _needs_synthesis(self, state: ActionFactoryState) -> bool:
+        """Whether the step results need an LLM pass to become the final answer
+        
+        A short, single-sentence prompt solved by one real tool is already answered by
+        that tool's output; summaries and placeholder output always go through the LLM.
+        """
+        step_results = state.step_results
+        if len(step_results) != 1 or step_results[0].get("tool_output") is None:
+            return True
+        
+        user_prompt = state.user_prompt.strip()
+        if len(user_prompt) >= _DIRECT_ANSWER_MAX_PROMPT_CHARS:
+            return True
         
+        return bool(_SENTENCE_BREAK.search(user_prompt))
+    
+    def _direct_answer_update(self, state: ActionFactoryState) -> Dict[str, Any]:
+        """Final-answer update that reuses the single step's tool output, skipping the LLM round-trip"""
+        return {
+            "final_answer": state.step_results[0]["tool_output"],
+            "workflow_complete": True
+        }
+    
+    def _final_answer_prompt(self, state: ActionFactoryState) -> str:
+        """Build the synthesis prompt for finalize_answer"""
+        return f"""
+            Original user request: {state.user_prompt}
+            
+            Step results:
+            {_json_dumps_indented(state.step_results)}
+            
+            Please provide a comprehensive final answer that addresses the user's original request,
+            incorporating all the step results.
+            """
+    
+    def _final_answer_update(self, state: ActionFactoryState, response: Optional[BaseMessage]) -> Dict[str, Any]:
+        """Turn the synthesis response (None when there is no LLM) into the final-answer update"""
+        if response is not None:
+            final_answer = _flatten_content(response.content)
+        else:
+            # Fallback answer
+            step_results = state.step_results
+            final_answer = f"Solved '{state.user_prompt}' through {len(step_results)} steps. Results: {[r['result'] for r in step_results]}"
+        
+        return {
+            "final_answer": final_answer,
+            "workflow_complete": True
+        }
+    
+    def _initial_state(self, user_prompt: str) -> ActionFactoryState:
+        """Initial graph state for a run (every other field starts at its default)"""
+        return ActionFactoryState(
+            messages=[HumanMessage(content=user_prompt)],
+            user_prompt=user_prompt
+        )
+    
+    def _run_result(self, final_state: Dict[str, Any]) -> Dict[str, Any]:
+        """Public result dict returned by run/arun (graph output is a dict of channel values)"""
         return {
             "final_answer": final_state.get("final_answer", ""),
             "step_results": final_state.get("step_results", []),
             "messages": final_state.get("messages", []),
             "workflow_complete": final_state.get("workflow_complete", False)
         }
+    
+    def run(self, user_prompt: str) -> Dict[str, Any]:
+        """Run the Action Factory workflow"""
+        final_state = self.graph.invoke(self._initial_state(user_prompt))
+        
+        return self._run_result(final_state)
+    
+    async def arun(self, user_prompt: str) -> Dict[str, Any]:
+        """Run the workflow on the event loop, awaiting LLM and tool calls instead of blocking"""
+        final_state = await self.graph.ainvoke(self._initial_state(user_prompt))
+        
+        return self._run_result(final_state)
+    
+    async def astream(self, user_prompt: str) -> AsyncIterator[Dict[str, Any]]:
+        """Yield each node's state update ({node_name: update}) as soon as the node finishes"""
+        async for update in self.graph.astream(self._initial_state(user_prompt), stream_mode="updates"):
+            yield update
 
 
 # Example usage and testing
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    
     # Create the Action Factory graph
     action_factory = ActionFactoryGraph()
     
@@ -428,13 +915,17 @@ if __name__ == "__main__":
     
     result = action_factory.run(test_prompt)
     
-    print("Workflow Results:")
-    print(f"Final Answer: {result['final_answer']}")
-    print(f"Workflow Complete: {result['workflow_complete']}")
-    print(f"Number of steps completed: {len(result['step_results'])}")
+    # Assemble the report in memory and write it once rather than per line
+    report = io.StringIO()
+    print("Workflow Results:", file=report)
+    print(f"Final Answer: {result['final_answer']}", file=report)
+    print(f"Workflow Complete: {result['workflow_complete']}", file=report)
+    print(f"Number of steps completed: {len(result['step_results'])}", file=report)
     
-    print("\nStep Details:")
+    print("\nStep Details:", file=report)
     for step in result['step_results']:
-        print(f"Step {step['step_index']}: {step['description']}")
-        print(f"Result: {step['result']}")
-        print()
\ No newline at end of file
+        print(f"Step {step['step_index']}: {step['description']}", file=report)
+        print(f"Result: {step['result']}", file=report)
+        print(file=report)
+    
+    sys.stdout.write(report.getvalue())
@@ -1,15 +1,95 @@
+from contextlib import asynccontextmanager
+import asyncio
+import os
 from fastapi import FastAPI, HTTPException, Depends
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 from passlib.context import CryptContext
-from database import get_db_connection, close_db_connection
-import psycopg2
-
-app = FastAPI()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from database import create_pool, close_pool, db
+import asyncpg
+import orjson
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One asyncpg pool per worker process, shared by every request
+    app.state.pool = await create_pool()
+    try:
+        yield
+    finally:
+        await close_pool(app.state.pool)
+
+# orjson serializes responses (including datetimes) in C instead of the stdlib encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# bcrypt cost factor; each +1 doubles the hashing time
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+if not 10 <= BCRYPT_ROUNDS <= 15:
+    raise ValueError("BCRYPT_ROUNDS must be between 10 and 15")
+
+# bcrypt_sha256 pre-hashes with SHA-256 so passwords past bcrypt's 72-byte limit aren't
+# truncated; plain bcrypt stays listed (as deprecated) so existing hashes still verify
+pwd_context = CryptContext(
+    schemes=["bcrypt_sha256", "bcrypt"],
+    bcrypt_sha256__rounds=BCRYPT_ROUNDS,
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    deprecated=["bcrypt"]
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# SQL shared by several routes. asyncpg already prepares each query once per
+# connection and reuses the plan from its statement cache (keyed on the text).
+SELECT_USER_ID = "SELECT id FROM USERS WHERE id = $1"
+INSERT_USER_TOOL = "INSERT INTO USERS_TOOLS (user_id, tool_name) VALUES ($1, $2)"
+# Postgres' default name for the USERS_TOOLS -> TOOLS foreign key in ai_studio_code.sql
+USERS_TOOLS_TOOL_FKEY = "users_tools_tool_name_fkey"
+# One multi-row insert for a whole batch; existing associations are skipped
+INSERT_USER_TOOLS = """
+    INSERT INTO USERS_TOOLS (user_id, tool_name)
+    SELECT unnest($1::bigint[]), $2
+    ON CONFLICT (user_id, tool_name) DO NOTHING
+"""
+
+SELECT_SESSION_CHATS = """
+    SELECT c.id, c.role, c.message, c.time FROM CHATS c
+    JOIN SESSIONS_CHAT sc ON c.id = sc.chat_id
+    WHERE sc.session_id = $1
+    ORDER BY c.time
+"""
+# Rows fetched per round-trip when streaming a session's chats
+CHAT_STREAM_BATCH = int(os.getenv('CHAT_STREAM_BATCH', '500'))
+
+# Check the user, insert the tool and link it in one round-trip. Nothing is
+# inserted (and no row comes back) when the user doesn't exist. The new
+# tool can only have the association made here, so user_ids comes from ins_assoc.
+CREATE_TOOL = """
+    WITH u AS (
+        SELECT id FROM USERS WHERE id = $1
+    ), ins_tool AS (
+        INSERT INTO TOOLS (name, description, code)
+        SELECT $2, $3, $4 WHERE EXISTS (SELECT 1 FROM u)
+        RETURNING name, description, code
+    ), ins_assoc AS (
+        INSERT INTO USERS_TOOLS (user_id, tool_name)
+        SELECT u.id, t.name FROM u, ins_tool t
+        RETURNING user_id
+    )
+    SELECT t.name, t.description, t.code, ARRAY(SELECT user_id FROM ins_assoc) AS user_ids
+    FROM ins_tool t
+"""
+
+# Insert the chat message and link it to the session in one round-trip
+CREATE_CHAT = """
+    WITH c AS (
+        INSERT INTO CHATS (role, message) VALUES ($2, $3) RETURNING id
+    ), sc AS (
+        INSERT INTO SESSIONS_CHAT (session_id, chat_id)
+        SELECT $1, id FROM c
+    )
+    SELECT id FROM c
+"""
+
 # Pydantic models
 class UserBase(BaseModel):
     name: str
@@ -19,9 +99,8 @@ class UserCreate(UserBase):
 
 class User(UserBase):
     id: int
-    
-    class Config:
-        from_attributes = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class Tool(BaseModel):
     name: str
@@ -34,192 +113,139 @@ class ToolCreate(Tool):
 class ToolResponse(Tool):
     user_ids: List[int] = []
 
+class ToolUsers(BaseModel):
+    # At least one id, so an unknown tool can't slip through as an empty no-op insert
+    user_ids: List[int] = Field(min_length=1)
+
 class Chat(BaseModel):
     role: str
     message: str
 
+def _association_not_found(e: asyncpg.ForeignKeyViolationError) -> HTTPException:
+    # Name whichever side of a USERS_TOOLS insert is missing
+    if e.constraint_name == USERS_TOOLS_TOOL_FKEY:
+        return HTTPException(status_code=404, detail="Tool not found")
+    return HTTPException(status_code=404, detail="User not found")
+
 # User routes
 @app.post("/users/", response_model=User)
-async def create_user(user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
-    conn = get_db_connection()
+async def create_user(user: UserCreate, conn=Depends(db)):
+    # bcrypt is deliberately slow; hash in a worker thread so the event loop keeps serving
+    hashed_password = await asyncio.to_thread(pwd_context.hash, user.password)
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO USERS (name, hashed_password) VALUES (%s, %s) RETURNING id, name",
-            (user.name, hashed_password)
+        new_user = await conn.fetchrow(
+            "INSERT INTO USERS (name, hashed_password) VALUES ($1, $2) RETURNING id, name",
+            user.name, hashed_password
         )
-        new_user = cur.fetchone()
-        conn.commit()
         return {"id": new_user["id"], "name": new_user["name"]}
-    except psycopg2.Error as e:
-        conn.rollback()
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        close_db_connection(conn)
 
 # Tool routes
 @app.post("/tools/", response_model=ToolResponse)
-async def create_tool(tool: ToolCreate):
-    conn = get_db_connection()
+async def create_tool(tool: ToolCreate, conn=Depends(db)):
     try:
-        cur = conn.cursor()
-        # First, verify the user exists
-        cur.execute("SELECT id FROM USERS WHERE id = %s", (tool.user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Begin transaction
-        cur.execute(
-            "INSERT INTO TOOLS (name, description, code) VALUES (%s, %s, %s) RETURNING *",
-            (tool.name, tool.description, tool.code)
-        )
-        new_tool = cur.fetchone()
-
-        # Create the user-tool association
-        cur.execute(
-            "INSERT INTO USERS_TOOLS (user_id, tool_name) VALUES (%s, %s)",
-            (tool.user_id, tool.name)
-        )
-        
-        # Get all users associated with this tool
-        cur.execute(
-            "SELECT user_id FROM USERS_TOOLS WHERE tool_name = %s",
-            (tool.name,)
+        new_tool = await conn.fetchrow(
+            CREATE_TOOL, tool.user_id, tool.name, tool.description, tool.code
         )
-        user_ids = [row["user_id"] for row in cur.fetchall()]
-        
-        conn.commit()
-        return {**new_tool, "user_ids": user_ids}
-    except psycopg2.Error as e:
-        conn.rollback()
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        close_db_connection(conn)
+    if not new_tool:
+        raise HTTPException(status_code=404, detail="User not found")
+    return dict(new_tool)
 
 @app.get("/tools/", response_model=List[ToolResponse])
-async def get_tools():
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT t.*, array_agg(ut.user_id) as user_ids
-            FROM TOOLS t
-            LEFT JOIN USERS_TOOLS ut ON t.name = ut.tool_name
-            GROUP BY t.name, t.description, t.code, t."createdAt"
-        """)
-        tools = cur.fetchall()
-        return tools
-    finally:
-        close_db_connection(conn)
+async def get_tools(conn=Depends(db)):
+    tools = await conn.fetch("""
+        SELECT t.name, t.description, t.code,
+               ARRAY(SELECT user_id FROM USERS_TOOLS WHERE tool_name = t.name) AS user_ids
+        FROM TOOLS t
+    """)
+    return [dict(tool) for tool in tools]
 
 @app.get("/users/{user_id}/tools/", response_model=List[ToolResponse])
-async def get_user_tools(user_id: int):
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        # First verify the user exists
-        cur.execute("SELECT id FROM USERS WHERE id = %s", (user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Get all tools associated with the user
-        cur.execute("""
-            SELECT t.*, array_agg(ut2.user_id) as user_ids
-            FROM TOOLS t
-            INNER JOIN USERS_TOOLS ut ON t.name = ut.tool_name
-            LEFT JOIN USERS_TOOLS ut2 ON t.name = ut2.tool_name
-            WHERE ut.user_id = %s
-            GROUP BY t.name, t.description, t.code, t."createdAt"
-        """, (user_id,))
-        tools = cur.fetchall()
-        return tools
-    finally:
-        close_db_connection(conn)
+async def get_user_tools(user_id: int, conn=Depends(db)):
+    # First verify the user exists
+    if not await conn.fetchrow(SELECT_USER_ID, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Get all tools associated with the user
+    tools = await conn.fetch("""
+        SELECT t.name, t.description, t.code,
+               ARRAY(SELECT user_id FROM USERS_TOOLS WHERE tool_name = t.name) AS user_ids
+        FROM TOOLS t
+        WHERE EXISTS (SELECT 1 FROM USERS_TOOLS WHERE tool_name = t.name AND user_id = $1)
+    """, user_id)
+    return [dict(tool) for tool in tools]
 
 @app.post("/tools/{tool_name}/users/{user_id}")
-async def associate_tool_with_user(tool_name: str, user_id: int):
-    conn = get_db_connection()
+async def associate_tool_with_user(tool_name: str, user_id: int, conn=Depends(db)):
     try:
-        cur = conn.cursor()
-        # Verify both tool and user exist
-        cur.execute("SELECT name FROM TOOLS WHERE name = %s", (tool_name,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Tool not found")
-            
-        cur.execute("SELECT id FROM USERS WHERE id = %s", (user_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="User not found")
-
-        # Create the association
-        cur.execute(
-            "INSERT INTO USERS_TOOLS (user_id, tool_name) VALUES (%s, %s)",
-            (user_id, tool_name)
-        )
-        conn.commit()
+        # The foreign keys verify both tool and user exist, so no lookups are needed first
+        await conn.execute(INSERT_USER_TOOL, user_id, tool_name)
         return {"message": "Tool associated with user successfully"}
-    except psycopg2.Error as e:
-        conn.rollback()
-        if "duplicate key" in str(e):
-            raise HTTPException(status_code=400, detail="Tool is already associated with this user")
+    except asyncpg.ForeignKeyViolationError as e:
+        raise _association_not_found(e)
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(status_code=400, detail="Tool is already associated with this user")
+    except asyncpg.PostgresError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/tools/{tool_name}/users/")
+async def associate_tool_with_users(tool_name: str, users: ToolUsers, conn=Depends(db)):
+    try:
+        # Create all the associations in a single statement; the foreign keys verify the tool and users exist
+        status = await conn.execute(INSERT_USER_TOOLS, users.user_ids, tool_name)
+        return {"message": "Tool associated with users successfully", "added": int(status.split()[-1])}
+    except asyncpg.ForeignKeyViolationError as e:
+        raise _association_not_found(e)
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        close_db_connection(conn)
 
 # Session routes
 @app.post("/sessions/")
-async def create_session():
-    conn = get_db_connection()
+async def create_session(conn=Depends(db)):
     try:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO SESSIONS DEFAULT VALUES RETURNING id")
-        session = cur.fetchone()
-        conn.commit()
+        session = await conn.fetchrow("INSERT INTO SESSIONS DEFAULT VALUES RETURNING id")
         return {"session_id": session["id"]}
-    except psycopg2.Error as e:
-        conn.rollback()
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        close_db_connection(conn)
 
 # Chat routes
 @app.post("/sessions/{session_id}/chats/")
-async def create_chat(session_id: int, chat: Chat):
-    conn = get_db_connection()
+async def create_chat(session_id: int, chat: Chat, conn=Depends(db)):
     try:
-        cur = conn.cursor()
-        # First create the chat message
-        cur.execute(
-            "INSERT INTO CHATS (role, message) VALUES (%s, %s) RETURNING id",
-            (chat.role, chat.message)
-        )
-        chat_id = cur.fetchone()["id"]
-        
-        # Then link it to the session
-        cur.execute(
-            "INSERT INTO SESSIONS_CHAT (session_id, chat_id) VALUES (%s, %s)",
-            (session_id, chat_id)
-        )
-        conn.commit()
+        chat_id = await conn.fetchval(CREATE_CHAT, session_id, chat.role, chat.message)
         return {"chat_id": chat_id, "session_id": session_id}
-    except psycopg2.Error as e:
-        conn.rollback()
+    except asyncpg.PostgresError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    finally:
-        close_db_connection(conn)
 
 @app.get("/sessions/{session_id}/chats/")
-async def get_session_chats(session_id: int):
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("""
-            SELECT c.* FROM CHATS c
-            JOIN SESSIONS_CHAT sc ON c.id = sc.chat_id
-            WHERE sc.session_id = %s
-            ORDER BY c.time
-        """, (session_id,))
-        chats = cur.fetchall()
-        return chats
-    finally:
-        close_db_connection(conn)
\ No newline at end of file
+async def get_session_chats(session_id: int, conn=Depends(db)):
+    # Run the query and fetch the first batch before the response starts, so a database
+    # failure still surfaces as an error status rather than a truncated 200. The db
+    # dependency holds the connection until the streamed body has finished (or was
+    # never sent) and releasing it rolls back a transaction left open.
+    transaction = conn.transaction(readonly=True)
+    await transaction.start()
+    cursor = await conn.cursor(SELECT_SESSION_CHATS, session_id)
+    batch = await cursor.fetch(CHAT_STREAM_BATCH)
+
+    async def stream(batch):
+        # Emit the same JSON array as before, a batch of rows at a time
+        try:
+            yield b"["
+            separator = b""
+            while batch:
+                for chat in batch:
+                    # Positional access avoids a name lookup per column per row
+                    yield separator + orjson.dumps(
+                        {"id": chat[0], "role": chat[1], "message": chat[2], "time": chat[3]}
+                    )
+                    separator = b","
+                batch = await cursor.fetch(CHAT_STREAM_BATCH)
+            yield b"]"
+        finally:
+            await transaction.rollback()
+
+    return StreamingResponse(stream(batch), media_type="application/json")
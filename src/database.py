@@ -1,26 +1,36 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncpg
 import os
-from urllib.parse import urlparse
+from fastapi import Request
 
-def get_db_connection():
+# Pool sizing and per-query timeout knobs
+POOL_MIN = int(os.getenv('DB_POOL_MIN', '2'))
+POOL_MAX = int(os.getenv('DB_POOL_MAX', '20'))
+COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', '60'))
+# Size of asyncpg's per-connection prepared statement cache (100 is asyncpg's own
+# default; set 0 behind a transaction-mode pooler such as pgbouncer)
+STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+
+async def create_pool():
     # Get the DATABASE_URL from environment variable
     database_url = os.getenv('DATABASE_URL')
     if not database_url:
         raise ValueError("DATABASE_URL environment variable is not set")
 
-    # Parse the DATABASE_URL
-    db_url = urlparse(database_url)
-    
-    return psycopg2.connect(
-        dbname=db_url.path[1:],  # Remove leading slash
-        user=db_url.username,
-        password=db_url.password,
-        host=db_url.hostname,
-        port=db_url.port,
-        cursor_factory=RealDictCursor
+    # asyncpg understands the postgresql:// URL directly
+    return await asyncpg.create_pool(
+        dsn=database_url,
+        min_size=POOL_MIN,
+        max_size=POOL_MAX,
+        command_timeout=COMMAND_TIMEOUT,
+        statement_cache_size=STATEMENT_CACHE_SIZE
     )
 
-def close_db_connection(conn):
-    if conn is not None:
-        conn.close()
\ No newline at end of file
+async def close_pool(pool):
+    if pool is not None:
+        await pool.close()
+
+async def db(request: Request):
+    # FastAPI dependency: check a connection out of the app's pool for the request.
+    # Releasing it resets any transaction a failed request left open.
+    async with request.app.state.pool.acquire() as conn:
+        yield conn
@@ -0,0 +1,34 @@
+import os
+import uvicorn
+
+# Server knobs
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', '8000'))
+UVICORN_WORKERS = int(os.getenv('UVICORN_WORKERS', '4'))
+# Per-worker cap on open connections/tasks before new ones get a 503
+UVICORN_LIMIT_CONCURRENCY = int(os.getenv('UVICORN_LIMIT_CONCURRENCY', '1024'))
+UVICORN_BACKLOG = int(os.getenv('UVICORN_BACKLOG', '2048'))
+UVICORN_RELOAD = os.getenv('UVICORN_RELOAD', 'false').lower() in ('1', 'true', 'yes')
+ACCESS_LOG = os.getenv('ACCESS_LOG', 'false').lower() in ('1', 'true', 'yes')
+
+def main():
+    # The reloader runs a single process, so it can't be combined with workers
+    if UVICORN_RELOAD and UVICORN_WORKERS > 1:
+        raise ValueError("UVICORN_RELOAD cannot be used with UVICORN_WORKERS > 1")
+
+    uvicorn.run(
+        'api:app',
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host=API_HOST,
+        port=API_PORT,
+        workers=None if UVICORN_RELOAD else UVICORN_WORKERS,
+        reload=UVICORN_RELOAD,
+        loop='uvloop',
+        http='httptools',
+        access_log=ACCESS_LOG,
+        limit_concurrency=UVICORN_LIMIT_CONCURRENCY,
+        backlog=UVICORN_BACKLOG
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.tools import tool
+
+from action_factory_graph import MAX_TOOL_RETRIES, ActionFactoryGraph, ProblemStep
+
+
+def make_graph(*replies):
+    """ActionFactoryGraph whose LLM answers with the given replies in order"""
+    return ActionFactoryGraph(llm=FakeListChatModel(responses=list(replies)))
+
+
+def test_prose_reply_with_non_step_list_falls_back_to_single_step():
+    for reply in ["I would use tools [1, 2] here.", 'Steps: ["add", "multiply"]', '{"description": "x"}']:
+        result = make_graph(reply, "final").run("add numbers")
+
+        assert result["workflow_complete"]
+        assert len(result["step_results"]) == 1
+        assert result["step_results"][0]["description"] == "Analyze and solve: add numbers"
+
+
+def test_step_list_wrapped_in_prose_is_parsed():
+    reply = 'Here is the plan:\n```json\n[{"description": "add", "required_tools": ["adder"]}]\n```'
+    result = make_graph(reply, "final").run("add numbers")
+
+    assert [step["description"] for step in result["step_results"]] == ["add"]
+
+
+def test_retry_rebuilds_the_failed_tool(monkeypatch):
+    monkeypatch.setattr("action_factory_graph._RETRY_BACKOFF_BASE_SECONDS", 0)
+    tested = []
+
+    def fail_first_instance(self, tool, test_input):
+        # Only the first tool object built fails; a genuine rebuild passes
+        tested.append(tool)
+        return tool is not tested[0]
+
+    monkeypatch.setattr(ActionFactoryGraph, "_test_tool", fail_first_instance)
+    result = ActionFactoryGraph().run("rebuild me")
+
+    assert result["workflow_complete"]
+    assert len(tested) == 2
+    assert tested[0] is not tested[1]
+
+
+def test_public_graph_is_bound_to_its_instance():
+    action_factory = ActionFactoryGraph()
+    final_state = action_factory.graph.invoke(action_factory._initial_state("invoke directly"))
+
+    assert final_state["workflow_complete"]
+
+
+def test_unbound_shared_graph_explains_missing_instance():
+    compiled = ActionFactoryGraph._get_compiled_graph()
+
+    with pytest.raises(ValueError, match="No ActionFactoryGraph bound"):
+        compiled.invoke(ActionFactoryGraph()._initial_state("unbound"))
+
+
+def test_fallback_plan_never_returns_placeholder_output_as_answer():
+    result = make_graph("not a plan", "synthesized").run("add 2 and 3")
+
+    assert result["final_answer"] == "synthesized"
+
+
+def test_single_real_tool_output_is_the_direct_answer():
+    class RealToolGraph(ActionFactoryGraph):
+        def _create_basic_tool(self, tool_name, step_description, force_rebuild=False):
+            @tool(tool_name)
+            def adder(query: str) -> str:
+                """Adds numbers"""
+                return "5"
+            return adder
+
+    reply = '[{"description": "add", "required_tools": ["adder"]}]'
+    graph = RealToolGraph(llm=FakeListChatModel(responses=[reply, "synthesized"]))
+
+    assert graph.run("add 2 and 3")["final_answer"] == "5"
+
+
+def test_step_levels_group_by_dependencies():
+    steps = [
+        ProblemStep("a"),
+        ProblemStep("b", dependencies=[0]),
+        ProblemStep("c", dependencies=[0]),
+        ProblemStep("d", dependencies=[1, 2]),
+    ]
+
+    assert ActionFactoryGraph()._compute_step_levels(steps) == [[0], [1, 2], [3]]
+
+
+def test_step_levels_put_cycles_in_a_final_level():
+    steps = [
+        ProblemStep("a", dependencies=[1]),
+        ProblemStep("b", dependencies=[0]),
+        ProblemStep("c"),
+        ProblemStep("d", dependencies=[2]),
+    ]
+
+    assert ActionFactoryGraph()._compute_step_levels(steps) == [[2], [3], [0, 1]]
+
+
+def test_step_levels_ignore_invalid_dependencies():
+    steps = [
+        ProblemStep("a", dependencies=[5, -1, "0"]),
+        ProblemStep("b", dependencies=[1]),
+    ]
+
+    assert ActionFactoryGraph()._compute_step_levels(steps) == [[0, 1]]
+
+
+PARALLEL_PLAN = """[
+    {"description": "first", "required_tools": ["t0"]},
+    {"description": "left", "required_tools": ["t1"], "dependencies": [0]},
+    {"description": "right", "required_tools": ["t2"], "dependencies": [0]}
+]"""
+
+
+def test_parallel_steps_merge_their_results():
+    action_factory = make_graph(PARALLEL_PLAN, "final")
+    final_state = action_factory.graph.invoke(action_factory._initial_state("parallel sync"))
+
+    assert sorted(r["step_index"] for r in final_state["step_results"]) == [0, 1, 2]
+    assert final_state["step_results"][0]["step_index"] == 0
+    assert all(step.completed and step.result for step in final_state["problem_steps"])
+    assert final_state["final_answer"] == "final"
+
+
+def test_parallel_steps_merge_their_results_async():
+    result = asyncio.run(make_graph(PARALLEL_PLAN, "final").arun("parallel async"))
+
+    assert sorted(r["step_index"] for r in result["step_results"]) == [0, 1, 2]
+    assert result["final_answer"] == "final"
+
+
+def test_empty_plan_goes_straight_to_the_final_answer():
+    result = make_graph("[]", "final").run("nothing to do")
+
+    assert result["step_results"] == []
+    assert result["final_answer"] == "final"
+    assert result["workflow_complete"]
+
+
+def test_failing_tool_is_retried_a_bounded_number_of_times(monkeypatch):
+    monkeypatch.setattr("action_factory_graph._RETRY_BACKOFF_BASE_SECONDS", 0)
+    monkeypatch.setattr(ActionFactoryGraph, "_test_tool", lambda self, tool, test_input: False)
+    builds = []
+    create_basic_tool = ActionFactoryGraph._create_basic_tool
+
+    def counting_create(self, tool_name, step_description, force_rebuild=False):
+        builds.append((tool_name, force_rebuild))
+        return create_basic_tool(self, tool_name, step_description, force_rebuild)
+
+    monkeypatch.setattr(ActionFactoryGraph, "_create_basic_tool", counting_create)
+    action_factory = ActionFactoryGraph()
+    final_state = action_factory.graph.invoke(action_factory._initial_state("always failing"))
+
+    assert builds == [("basic_solver", False)] + [("basic_solver", True)] * MAX_TOOL_RETRIES
+    assert final_state["tool_retry_count"] == {"basic_solver": MAX_TOOL_RETRIES}
+    # Retries exhausted: the level is still solved and the run completes
+    assert len(final_state["step_results"]) == 1
+    assert final_state["workflow_complete"]
+
+
+def sleeping_tools(names, seconds, calls=None):
+    """Tools that each take `seconds` to answer, recording their names in `calls`"""
+    def make(name):
+        @tool(name)
+        def sleeper(query: str) -> str:
+            """Sleeps, then answers"""
+            if calls is not None:
+                calls.append(name)
+            time.sleep(seconds)
+            return "done"
+        return sleeper
+    return {name: make(name) for name in names}
+
+
+def test_tools_queued_behind_other_steps_are_not_timed_out(monkeypatch):
+    monkeypatch.setattr("action_factory_graph._TOOL_EXECUTOR", ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr("action_factory_graph._TOOL_TIMEOUT_SECONDS", 0.5)
+    action_factory = ActionFactoryGraph()
+    names = [f"t{i}" for i in range(3)]
+    step = ProblemStep("slow", required_tools=names)
+
+    # 4 steps x 3 tools of 0.2s on 2 workers: the last ones wait far longer than
+    # the timeout to start, but none runs longer than it
+    with ThreadPoolExecutor(max_workers=4) as steps:
+        solved = list(steps.map(
+            lambda _: action_factory._solve_with_tools(step, sleeping_tools(names, 0.2)), range(4)
+        ))
+
+    for summary, tool_outputs in solved:
+        assert "Error" not in summary
+        assert tool_outputs == {name: "done" for name in names}
+
+
+def test_tool_without_a_free_worker_is_cancelled_unrun(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("action_factory_graph._TOOL_EXECUTOR", executor)
+    monkeypatch.setattr("action_factory_graph._TOOL_QUEUE_TIMEOUT_SECONDS", 0.1)
+    release = threading.Event()
+    executor.submit(release.wait)
+    calls = []
+
+    try:
+        summary, tool_outputs = ActionFactoryGraph()._solve_with_tools(
+            ProblemStep("queued", required_tools=["t0"]), sleeping_tools(["t0"], 0, calls)
+        )
+    finally:
+        release.set()
+    executor.shutdown(wait=True)
+
+    assert "t0: Error - no free worker within 0.1s" in summary
+    assert tool_outputs == {}
+    assert calls == []
+
+
+def test_tool_running_past_its_timeout_is_reported(monkeypatch):
+    monkeypatch.setattr("action_factory_graph._TOOL_TIMEOUT_SECONDS", 0.1)
+
+    summary, tool_outputs = ActionFactoryGraph()._solve_with_tools(
+        ProblemStep("hung", required_tools=["t0"]), sleeping_tools(["t0"], 0.5)
+    )
+
+    assert "t0: Error - timed out after 0.1s" in summary
+    assert tool_outputs == {}
@@ -0,0 +1,187 @@
+import asyncio
+
+import asyncpg
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import api
+from database import db
+
+
+class FakeTransaction:
+    async def start(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+
+    async def fetch(self, n):
+        batch, self.rows = self.rows[:n], self.rows[n:]
+        return batch
+
+
+class FakeConnection:
+    def __init__(self, rows=(), error=None, status="INSERT 0 1"):
+        self.rows = rows
+        self.error = error
+        self.status = status
+        self.executed = []
+
+    async def execute(self, query, *args):
+        if self.error is not None:
+            raise self.error
+        self.executed.append(args)
+        return self.status
+
+    def transaction(self, readonly=False):
+        return FakeTransaction()
+
+    async def cursor(self, query, *args):
+        if self.error is not None:
+            raise self.error
+        return FakeCursor(self.rows)
+
+
+class FakeAcquire:
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __aenter__(self):
+        self.pool.checked_out += 1
+        return self.pool.conn
+
+    async def __aexit__(self, *exc_info):
+        self.pool.checked_out -= 1
+
+
+class FakePool:
+    def __init__(self, conn):
+        self.conn = conn
+        self.checked_out = 0
+
+    def acquire(self):
+        # Used as `async with pool.acquire() as conn`, like asyncpg's pool
+        return FakeAcquire(self)
+
+
+@pytest.fixture
+def client():
+    # No lifespan: each test installs its own fake pool
+    return TestClient(api.app, raise_server_exceptions=False)
+
+
+@pytest.fixture
+def use_conn():
+    # Serve the db dependency from a fake connection instead of the pool
+    def install(conn):
+        api.app.dependency_overrides[db] = lambda: conn
+        return conn
+    yield install
+    api.app.dependency_overrides.clear()
+
+
+def test_session_chats_streams_rows_as_json_array(client, monkeypatch):
+    monkeypatch.setattr(api, "CHAT_STREAM_BATCH", 2)
+    rows = [(i, "user", f"m{i}", None) for i in range(5)]
+    api.app.state.pool = pool = FakePool(FakeConnection(rows))
+
+    response = client.get("/sessions/1/chats/")
+
+    assert response.status_code == 200
+    assert [chat["message"] for chat in response.json()] == [f"m{i}" for i in range(5)]
+    assert pool.checked_out == 0
+
+
+def test_session_chats_query_failure_is_an_error_status(client):
+    api.app.state.pool = pool = FakePool(FakeConnection(error=asyncpg.PostgresError("boom")))
+
+    response = client.get("/sessions/1/chats/")
+
+    assert response.status_code == 500
+    assert pool.checked_out == 0
+
+
+def test_session_chats_connection_released_when_body_never_sent():
+    api.app.state.pool = pool = FakePool(FakeConnection([(1, "user", "hi", None)]))
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/sessions/1/chats/",
+        "raw_path": b"/sessions/1/chats/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        # How a client disconnect surfaces before the response starts
+        if message["type"] == "http.response.start":
+            raise OSError("client went away")
+
+    # Starlette reports the failed send as a ClientDisconnect
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(api.app(scope, receive, send))
+    assert pool.checked_out == 0
+
+
+def fk_violation(constraint_name):
+    return asyncpg.ForeignKeyViolationError.new({"C": "23503", "M": "fk violation", "n": constraint_name})
+
+
+@pytest.mark.parametrize("path,body", [
+    ("/tools/t/users/1", None),
+    ("/tools/t/users/", {"user_ids": [1, 2]}),
+])
+@pytest.mark.parametrize("constraint_name,detail", [
+    ("users_tools_tool_name_fkey", "Tool not found"),
+    ("users_tools_user_id_fkey", "User not found"),
+])
+def test_association_missing_side_is_404(client, use_conn, path, body, constraint_name, detail):
+    use_conn(FakeConnection(error=fk_violation(constraint_name)))
+
+    response = client.post(path, json=body)
+
+    assert response.status_code == 404
+    assert response.json() == {"detail": detail}
+
+
+def test_duplicate_association_is_400(client, use_conn):
+    use_conn(FakeConnection(error=asyncpg.UniqueViolationError.new({"C": "23505", "M": "duplicate key"})))
+
+    response = client.post("/tools/t/users/1")
+
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Tool is already associated with this user"}
+
+
+def test_bulk_association_reports_rows_added(client, use_conn):
+    conn = use_conn(FakeConnection(status="INSERT 0 2"))
+
+    response = client.post("/tools/t/users/", json={"user_ids": [1, 2, 3]})
+
+    assert response.status_code == 200
+    assert response.json()["added"] == 2
+    assert conn.executed == [([1, 2, 3], "t")]
+
+
+def test_bulk_association_needs_user_ids(client, use_conn):
+    conn = use_conn(FakeConnection())
+
+    response = client.post("/tools/t/users/", json={"user_ids": []})
+
+    assert response.status_code == 422
+    assert conn.executed == []